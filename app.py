@@ -4,12 +4,13 @@ import streamlit as st
 from typing import List, Optional, Dict
 import tempfile
 from helpers.retriever import hybrid_search_with_rerank
-from helpers.chain import build_rag_chain, build_summary_chain
+from helpers.chain import build_rag_answer_chain, build_summary_chain, format_output
 from langchain_groq import ChatGroq
 from langchain.schema import Document
-from helpers.vectorstore import get_vectorstore, get_bm25, store_chunks, get_bm25_retriever
+from helpers.vectorstore import get_vectorstore, get_bm25, store_chunks, get_bm25_retriever, get_categories
 from helpers.pdfloader import load_pdfs
 from helpers.chunker import chunk_documents
+from process_pdfs import run_pipeline
 
 # Initialize session state for conversation memory
 if "conversation_history" not in st.session_state:
@@ -19,16 +20,23 @@ if "conversation_history" not in st.session_state:
 # Caching loaders with hash functions to invalidate cache on file changes
 @st.cache_resource(show_spinner=False, hash_funcs={str: lambda x: os.path.getmtime(x) if os.path.exists(x) else 0})
 def load_vectorstore(faiss_dir: str) -> ChatGroq:
-    """Load FAISS vectorstore, cached to avoid repeated loading."""
-    return get_vectorstore(faiss_dir=faiss_dir)
+    """Load FAISS vectorstore (on GPU when available), cached to avoid repeated loading."""
+    # Bypass the helper's per-path lru_cache so a rebuilt index (new mtime) is reloaded
+    return get_vectorstore.__wrapped__(faiss_dir=faiss_dir)
 
 
-@st.cache_resource(show_spinner=False, hash_funcs={str: lambda x: os.path.getmtime(x) if os.path.exists(x) else 0})
-def load_bm25(bm25_file: str):
-    """Load BM25 retriever from file with error handling."""
-    bm25 = get_bm25(bm25_file=bm25_file)
+def bm25_mtime(bm25_dir: str) -> float:
+    """Modification time of the BM25 index actually read: the directory, else its legacy .pkl."""
+    path = bm25_dir if os.path.isdir(bm25_dir) else bm25_dir + ".pkl"
+    return os.path.getmtime(path) if os.path.exists(path) else 0
+
+
+@st.cache_resource(show_spinner=False)
+def load_bm25(bm25_dir: str, mtime: float):
+    """Load BM25 index from directory (or its legacy .pkl), cached per path and mtime (see bm25_mtime)."""
+    bm25 = get_bm25.__wrapped__(bm25_dir=bm25_dir)  # Reload on mtime change, see load_vectorstore
     if bm25 is None:
-        st.error(f"BM25 index {bm25_file} not found. Run 'python process_pdfs.py' or upload PDFs to generate it.")
+        st.error(f"BM25 index {bm25_dir} not found. Run 'python process_pdfs.py' or upload PDFs to generate it.")
     return bm25
 
 
@@ -42,7 +50,10 @@ def load_reranker():
 @st.cache_resource(show_spinner=False, hash_funcs={str: lambda x: os.path.getmtime(x) if os.path.exists(x) else 0})
 def load_categories_from_chunks(chunks_file: str) -> List[str]:
     """
-    Extract unique document categories from a pickled chunks file.
+    Extract unique document categories from a chunks file.
+
+    Queries the SQLite chunk database saved next to the pickle, falling back to the
+    pickled chunks for document sets built before it existed.
 
     Args:
         chunks_file (str): Path to pickled chunk file.
@@ -51,6 +62,9 @@ def load_categories_from_chunks(chunks_file: str) -> List[str]:
         List[str]: Sorted list of unique categories; returns ["all"] if failed.
     """
     try:
+        db_file = chunks_file.replace(".pkl", ".sqlite")
+        if os.path.exists(db_file):
+            return get_categories(db_file)
         with open(chunks_file, "rb") as f:
             chunks = pickle.load(f)
         if not isinstance(chunks, list):
@@ -67,7 +81,7 @@ def get_llm(model_name: str, temperature: float) -> ChatGroq:
     """Initialize LLM with Groq API key"""
     if not os.getenv("GROQ_API_KEY"):
         st.warning("GROQ_API_KEY not set in environment. Set it before running.")
-    return ChatGroq(model=model_name, temperature=temperature)
+    return ChatGroq(model=model_name, temperature=temperature, streaming=True)
 
 
 # Process uploaded PDFs
@@ -79,9 +93,14 @@ def process_uploaded_pdfs(uploaded_files):
                 file_path = os.path.join(tmp_dir, uploaded_file.name)
                 with open(file_path, "wb") as f:
                     f.write(uploaded_file.getbuffer())
-            import subprocess
-            subprocess.run(["python", "process_pdfs.py", "--input_dir", tmp_dir, "--output_prefix", "uploaded_chunks"])
-        st.success("PDFs processed. Please clear cache and reload to use new data.")
+            # Process in-process to reuse already-imported libraries and loaded models
+            with st.spinner("Processing PDFs..."):
+                ok = run_pipeline(input_dir=tmp_dir, output_prefix="uploaded_chunks")
+        if not ok:
+            st.error("Processing failed: no text could be extracted or indexes could not be built. Check the server logs for details.")
+            return
+        st.cache_resource.clear()  # Drop cached indexes/categories so the new set is picked up
+        st.success("PDFs processed. Select 'uploaded_chunks.pkl' to use the new data.")
     else:
         st.warning("No PDFs uploaded. Using preprocessed default data.")
 
@@ -147,26 +166,21 @@ with col1:
         filters = {"category": category} if category and category.lower() != "all" else None
         with st.spinner("Retrieving..."):
             faiss_dir = f"{chunk_file.replace('.pkl', '')}_faiss_store" if "_chunks" not in chunk_file else chunk_file.replace(".pkl", "_faiss_store")
-            bm25_file = f"{chunk_file.replace('.pkl', '')}_bm25.pkl" if "_chunks" not in chunk_file else chunk_file.replace(".pkl", "_bm25.pkl")
-            docs = hybrid_search_with_rerank(question.strip(), k=k, filters=filters, rerank_top_n=rerank_top_n)
+            bm25_dir = f"{chunk_file.replace('.pkl', '')}_bm25" if "_chunks" not in chunk_file else chunk_file.replace(".pkl", "_bm25")
+            docs = hybrid_search_with_rerank(question.strip(), k=k, filters=filters, rerank_top_n=rerank_top_n, faiss_store=load_vectorstore(faiss_dir), bm25=load_bm25(bm25_dir, bm25_mtime(bm25_dir)))
         if not docs:
             st.error("No relevant documents found.")
         else:
-            with st.spinner("Generating answer..."):
-                llm = get_llm(model, temperature)
-                chain = build_rag_chain(llm)
-                result = chain.invoke({"question": question.strip(), "docs": docs})
-                if isinstance(result, dict):
-                    ans = result.get("response", "Error processing response")
-                    context = result.get("context", "")
-                    sources = result.get("sources", "")
-                else:
-                    ans = result.content if hasattr(result, "content") else "Error processing response"
-                    context = ""
-                    sources = ""
-            st.session_state.conversation_history.append({"role": "assistant", "content": ans})
+            llm = get_llm(model, temperature)
+            chain = build_rag_answer_chain(llm)
             st.markdown("### Answer")
-            st.write(ans)
+            # Render tokens as they arrive; context and sources are formatted from the full answer
+            ans = st.write_stream(chain.stream({"question": question.strip(), "docs": docs}))
+            result = format_output({"response": ans, "docs": docs})
+            ans = result["response"]
+            context = result["context"]
+            sources = result["sources"]
+            st.session_state.conversation_history.append({"role": "assistant", "content": ans})
             if sources and context:
                 st.markdown("### Sources")
                 st.write(sources)
@@ -183,23 +197,17 @@ with col1:
         filters = {"category": category} if category and category.lower() != "all" else None
         with st.spinner("Retrieving..."):
             faiss_dir = f"{chunk_file.replace('.pkl', '')}_faiss_store" if "_chunks" not in chunk_file else chunk_file.replace(".pkl", "_faiss_store")
-            bm25_file = f"{chunk_file.replace('.pkl', '')}_bm25.pkl" if "_chunks" not in chunk_file else chunk_file.replace(".pkl", "_bm25.pkl")
-            docs = hybrid_search_with_rerank(question.strip() if question else "Summarize EFDA medical guidelines", k=k, filters=filters, rerank_top_n=rerank_top_n)
+            bm25_dir = f"{chunk_file.replace('.pkl', '')}_bm25" if "_chunks" not in chunk_file else chunk_file.replace(".pkl", "_bm25")
+            docs = hybrid_search_with_rerank(question.strip() if question else "Summarize EFDA medical guidelines", k=k, filters=filters, rerank_top_n=rerank_top_n, faiss_store=load_vectorstore(faiss_dir), bm25=load_bm25(bm25_dir, bm25_mtime(bm25_dir)))
         if not docs:
             st.error("No relevant documents found.")
         else:
-            with st.spinner("Generating summary..."):
-                llm = get_llm(model, temperature)
-                chain = build_summary_chain(llm)
-                result = chain.invoke({"docs": docs})
-                if isinstance(result, dict):
-                    summary = result.get("response", "Error processing response")
-                    sources = result.get("sources", "")
-                else:
-                    summary = result.content if hasattr(result, "content") else "Error processing response"
-                    sources = ""
+            llm = get_llm(model, temperature)
+            chain = build_summary_chain(llm)
             st.markdown("### Summary")
-            st.write(summary)
+            # Render tokens as they arrive; sources are formatted from the full summary
+            summary = st.write_stream(chain.stream({"docs": docs}))
+            sources = format_output({"response": summary, "docs": docs})["sources"]
             if sources:
                 st.markdown("### Sources")
                 st.write(sources)
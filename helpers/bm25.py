@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+from collections import Counter
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix, spmatrix
+from langchain.schema import Document
+from typing import Dict, List, Optional
+
+
+def preprocess(text: str) -> List[str]:
+    """
+    Tokenize text for BM25 (whitespace split, as LangChain's BM25Retriever does).
+
+    Args:
+        text (str): Text to tokenize.
+
+    Returns:
+        List[str]: Tokens in order of appearance.
+    """
+    return text.split()
+
+
+class BM25Index:
+    """
+    Okapi BM25 keyword retriever backed by a sparse term-frequency matrix.
+
+    Scores match rank_bm25's BM25Okapi, but are computed with NumPy over the query
+    terms' columns instead of per-term Python loops.
+    """
+
+    def __init__(
+            self,
+            tf: spmatrix,
+            idf: np.ndarray,
+            doc_len: np.ndarray,
+            vocab: Dict[str, int],
+            docs: List[Document],
+            k: int = 4,
+            k1: float = 1.5,
+            b: float = 0.75):
+        """
+        Args:
+            tf (spmatrix): Term frequencies, shape (n_docs, n_terms).
+            idf (np.ndarray): Inverse document frequency per term.
+            doc_len (np.ndarray): Number of tokens per document.
+            vocab (Dict[str, int]): Term to column index mapping.
+            docs (List[Document]): Documents, in the row order of tf.
+            k (int, optional): Number of documents returned by invoke. Defaults to 4.
+            k1 (float, optional): BM25 term-frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+        """
+        self.tf = tf.tocsc(copy=False)  # Column slicing by query term is the hot path
+        self.idf = idf
+        self.doc_len = doc_len
+        self.avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+        self.vocab = vocab
+        self.docs = docs
+        self.k = k
+        self.k1 = k1
+        self.b = b
+        # Document-length normalization is query-independent, so compute it once
+        self.norm = np.zeros(len(doc_len), dtype=np.float32)
+        if len(doc_len):
+            self.norm[:] = k1 * (1 - b + b * doc_len / self.avgdl)
+
+    @classmethod
+    def from_documents(cls, docs: List[Document], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25) -> "BM25Index":
+        """
+        Build a BM25 index from documents.
+
+        Args:
+            docs (List[Document]): Documents to index.
+            k1 (float, optional): BM25 term-frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+            epsilon (float, optional): Floor for negative IDFs, as a fraction of the
+                mean IDF. Defaults to 0.25.
+
+        Returns:
+            BM25Index: The built index.
+        """
+        vocab: Dict[str, int] = {}
+        rows, cols, counts = [], [], []
+        doc_len = np.zeros(len(docs), dtype=np.int32)
+
+        for i, doc in enumerate(docs):
+            tokens = preprocess(doc.page_content)
+            doc_len[i] = len(tokens)
+            for term, count in Counter(tokens).items():
+                rows.append(i)
+                cols.append(vocab.setdefault(term, len(vocab)))
+                counts.append(count)
+
+        tf = csr_matrix((np.asarray(counts, dtype=np.float32), (rows, cols)), shape=(len(docs), len(vocab)))
+
+        # Okapi IDF with negative values floored to epsilon * mean IDF (rank_bm25 semantics)
+        df = np.bincount(np.asarray(cols, dtype=np.int64), minlength=len(vocab))
+        idf = np.log(len(docs) - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        return cls(tf, idf.astype(np.float32), doc_len, vocab, docs, k1=k1, b=b)
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """
+        Compute the BM25 score of every document for a query.
+
+        Args:
+            query (str): Search query string.
+
+        Returns:
+            np.ndarray: One score per document.
+        """
+        term_ids = [self.vocab[t] for t in preprocess(query) if t in self.vocab]
+        if not term_ids:
+            return np.zeros(len(self.docs), dtype=np.float32)
+
+        tf = self.tf[:, term_ids].toarray()
+        return (self.idf[term_ids] * (tf * (self.k1 + 1)) / (tf + self.norm[:, None])).sum(axis=1)
+
+    def invoke(self, query: str, k: Optional[int] = None) -> List[Document]:
+        """
+        Retrieve the highest-scoring documents for a query.
+
+        Args:
+            query (str): Search query string.
+            k (Optional[int], optional): Number of documents to return. Defaults to self.k.
+
+        Returns:
+            List[Document]: Documents sorted by descending BM25 score.
+        """
+        scores = self.get_scores(query)
+        k = min(self.k if k is None else k, len(scores))
+        if k <= 0:
+            return []
+
+        # Select the top-k in O(n), then order only those k (ties broken by document order)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [self.docs[i] for i in top]
+
+    def save(self, path: str) -> None:
+        """
+        Save the index to a directory: one uncompressed .npy file per array (so they
+        can be memory-mapped on load), plus the vocabulary and documents as JSON.
+
+        Args:
+            path (str): Output directory; replaced if it already exists.
+        """
+        if os.path.exists(path):
+            shutil.rmtree(path)  # Rebuild from scratch so stale arrays never linger
+        os.makedirs(path)
+
+        # Stored column-major (CSC), the layout used for scoring, so loading needs no conversion
+        arrays = {
+            "data": self.tf.data,
+            "indices": self.tf.indices,
+            "indptr": self.tf.indptr,
+            "idf": self.idf,
+            "doc_len": self.doc_len
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+
+        with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({"terms": sorted(self.vocab, key=self.vocab.get), "shape": list(self.tf.shape), "k1": self.k1, "b": self.b}, f)
+        with open(os.path.join(path, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump([{"page_content": d.page_content, "metadata": d.metadata} for d in self.docs], f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "BM25Index":
+        """
+        Load an index saved with save().
+
+        Args:
+            path (str): Directory written by save().
+            mmap (bool, optional): Memory-map the arrays read-only instead of reading
+                them into memory. Defaults to True.
+
+        Returns:
+            BM25Index: The loaded index.
+        """
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None, allow_pickle=False)
+            for name in ("data", "indices", "indptr", "idf", "doc_len")
+        }
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "docs.json"), encoding="utf-8") as f:
+            docs = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in json.load(f)]
+
+        # Wrap the (memory-mapped) arrays without copying them
+        tf = csc_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(meta["shape"]), copy=False)
+        vocab = {term: i for i, term in enumerate(meta["terms"])}
+        return cls(tf, arrays["idf"], arrays["doc_len"], vocab, docs, k1=meta["k1"], b=meta["b"])
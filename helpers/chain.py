@@ -1,13 +1,47 @@
 from langchain_groq import ChatGroq
 from langchain.schema import Document, AIMessage
 from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableSequence, RunnableLambda, RunnablePassthrough
-from typing import List, Optional, Dict
+from functools import lru_cache
+from typing import List, Optional, Dict, Tuple
+
+__all__ = [
+    "build_rag_chain",
+    "build_rag_answer_chain",
+    "build_summary_chain",
+    "format_context",
+    "format_sources",
+    "format_output"
+]
+
+_NL_TABLE = str.maketrans({"\n": " ", "\r": " "})
+
+def _context_key(docs: List[Document]) -> Tuple[Tuple[str, Optional[int], str], ...]:
+    """Hashable (title, page, content) key of the documents rendered by format_context."""
+    return tuple(
+        (d.metadata.get("doc_title", "Unknown"), d.metadata.get("page"), d.page_content)
+        for d in docs if isinstance(d, Document)
+    )
+
+
+@lru_cache(maxsize=128)
+def _format_context(key: Tuple[Tuple[str, Optional[int], str], ...], max_snippet_len: int) -> str:
+    """Cached body of format_context, keyed on _context_key(docs)."""
+    # Snippets have line breaks mapped to spaces in a single C-level translate pass
+    return "\n".join(
+        f"- [{title}{f' p.{page}' if page is not None else ''}] {content.translate(_NL_TABLE).strip()[:max_snippet_len]}..."
+        for title, page, content in key
+    ) or "- (no context)"
+
 
 def format_context(docs: List[Document], max_snippet_len: int = 200) -> str:
     """
     Format document chunks into a readable context string for inclusion in prompts.
 
+    Results are memoized on the documents' title, page and content, so the same
+    retrieval formatted again (e.g. on a Streamlit rerun) skips the string building.
+
     Args:
         docs (List[Document]): A list of LangChain Document objects, each containing
             page content and metadata.
@@ -19,18 +53,21 @@ def format_context(docs: List[Document], max_snippet_len: int = 200) -> str:
         title and page number (if available). Returns "- (no context)" if no documents
         are provided.
     """
-    lines = []
-    
-    for d in docs:  # Iterate over Document objects directly
-        if isinstance(d, Document):
-            title = d.metadata.get("doc_title", "Unknown")
-            page = d.metadata.get("page")
-            page_str = f" p.{page}" if page is not None else ""
-            
-            # Extract snippet from page content with newlines replaced
-            snippet = d.page_content.strip().replace("\n", " ")[:max_snippet_len]
-            lines.append(f"- [{title}{page_str}] {snippet}...")
-    return "\n".join(lines) or "- (no context)"
+    return _format_context(_context_key(docs), max_snippet_len)
+
+
+@lru_cache(maxsize=128)
+def _format_sources(key: Tuple[Tuple[str, Optional[int]], ...]) -> str:
+    """Cached body of format_sources, keyed on the documents' (title, page) pairs."""
+    seen = set()
+    sources = []
+
+    for title, page in key:
+        entry = f"{title} p.{page}" if page is not None else title
+        if entry not in seen:
+            seen.add(entry)
+            sources.append(f"- {entry}")
+    return "\n".join(sources) or "- (no sources)"
 
 
 def format_sources(docs: List[Document]) -> str:
@@ -44,36 +81,58 @@ def format_sources(docs: List[Document]) -> str:
         str: A string containing formatted source titles and pages.
         Returns "- (no sources)" if none are available.
     """
-    seen = set()
-    sources = []
+    return _format_sources(tuple(
+        (d.metadata.get("doc_title", "Unknown"), d.metadata.get("page"))
+        for d in docs if isinstance(d, Document)
+    ))
 
-    for d in docs:  
-        if isinstance(d, Document):
-            title = d.metadata.get("doc_title", "Unknown")
-            page = d.metadata.get("page")
-            entry = f"{title} p.{page}" if page is not None else title
-            if entry not in seen:
-                seen.add(entry)
-                sources.append(f"- {entry}")
-    return "\n".join(sources) or "- (no sources)"
 
+def format_output(input_data: Dict) -> Dict:
+    """
+    Format a RAG answer by including response, context, and sources.
 
-def build_rag_chain(llm: ChatGroq) -> RunnableSequence:
+    Args:
+        input_data (Dict[str, object]): A dictionary containing:
+            - "response": str (or AIMessage) answer from the LLM.
+            - "docs": List[Document] used as context.
+
+    Returns:
+        Dict[str, str]: Structured output containing:
+            - "response": str
+            - "context": str
+            - "sources": str
     """
-    Build RAG chain for medical Q&A with PromptTemplate and LLM.
+    response = input_data.get("response")  # Response from LLM
+    if isinstance(response, AIMessage):
+        response = response.content
+    content = response if response else "Error processing response"
+
+    # If the model explicitly indicates no relevant information was found
+    if "I could not find relevant information" in content:
+        return {"response": content, "context": "", "sources": ""}
+    else:
+        return {
+            "response": content,
+            "context": format_context(input_data["docs"]),
+            "sources": format_sources(input_data["docs"])
+        }
 
-     Args:
+
+def build_rag_answer_chain(llm: ChatGroq) -> RunnableSequence:
+    """
+    Build the prompt -> LLM part of the RAG chain, producing the answer text only.
+
+    Use its .stream() to render the answer token by token, then call format_output
+    on the full answer to get context and sources.
+
+    Args:
         llm (ChatGroq): A Groq-powered LLM instance used for inference.
 
     Returns:
         RunnableSequence: A LangChain Runnable sequence that takes input with:
             - "docs": List[Document]
             - "question": str
-        And outputs a dictionary with:
-            - "response": str (answer from LLM)
-            - "context": str (formatted snippets)
-            - "sources": str (formatted sources)
-
+        And outputs the answer as a str (streamed as str chunks).
     """
     prompt = PromptTemplate.from_template("""
 You are a medical assistant specialized in EFDA (Ethiopian Food and Drug Authority) guidelines for medicine registration, import, and export regulations.
@@ -89,44 +148,35 @@ Q: {question}
 A:
 """)
 
+    # Compose prompt and LLM directly so the template is rendered once per request
+    return (
+        RunnablePassthrough.assign(context=lambda x: format_context(x["docs"]))
+        | prompt
+        | llm
+        | StrOutputParser()
+    )
 
-    def format_output(input_data: Dict) -> Dict:
-        """
-        Format the chain's final output by including response, context, and sources.
-
-        Args:
-            input_data (Dict[str, object]): A dictionary containing:
-                - "response": AIMessage from the LLM.
-                - "docs": List[Document] used as context.
-
-        Returns:
-            Dict[str, str]: Structured output containing:
-                - "response": str
-                - "context": str
-                - "sources": str
-        """
-        response: AIMessage = input_data.get("response")  # Response from LLM
-        content = response.content if response else "Error processing response"
-        
-        # If the model explicitly indicates no relevant information was found
-        if "I could not find relevant information" in content:
-            return {"response": content, "context": "", "sources": ""}
-        else:
-            return {
-                "response": content,
-                "context": format_context(input_data["docs"]),
-                "sources": format_sources(input_data["docs"])
-            }
-
-    # Assemble the chain using LangChain Runnables
+
+def build_rag_chain(llm: ChatGroq) -> RunnableSequence:
+    """
+    Build RAG chain for medical Q&A with PromptTemplate and LLM.
+
+     Args:
+        llm (ChatGroq): A Groq-powered LLM instance used for inference.
+
+    Returns:
+        RunnableSequence: A LangChain Runnable sequence that takes input with:
+            - "docs": List[Document]
+            - "question": str
+        And outputs a dictionary with:
+            - "response": str (answer from LLM)
+            - "context": str (formatted snippets)
+            - "sources": str (formatted sources)
+
+    """
+    # "question" and "docs" pass through untouched to format_output
     return (
-        {
-            "context": lambda x: format_context(x["docs"]),
-            "question": lambda x: x["question"],
-            "docs": lambda x: x["docs"]
-        }
-        # Invoke the LLM with formatted prompt
-        | RunnablePassthrough.assign(response=lambda x: llm.invoke(prompt.format(context=x["context"], question=x["question"])))
+        RunnablePassthrough.assign(response=build_rag_answer_chain(llm))
         | RunnableLambda(format_output)
     )
 
@@ -140,10 +190,7 @@ def build_summary_chain(llm: ChatGroq) -> RunnableSequence:
     Returns:
         RunnableSequence: A LangChain Runnable sequence that takes input with:
             - "docs": List[Document]
-        And outputs:
-            - "context": str (formatted snippets)
-            - "sources": str (formatted sources)
-            - "summary": str (concise summary of docs)
+        And outputs the concise summary of docs as a str (streamed as str chunks).
     """
     prompt = PromptTemplate.from_template("""
 You are a medical assistant specialized in EFDA (Ethiopian Food and Drug Authority) guidelines for medicine registration, import, and export regulations.
@@ -157,12 +204,13 @@ Context:
 Summary:
 """)
     
-    # Chain: extract context/sources -> build prompt -> run LLM
+    # Chain: extract context/sources -> build prompt -> run LLM -> answer text
     return RunnableSequence(
         {
             "context": lambda x: format_context(x["docs"]),
             "sources": lambda x: format_sources(x["docs"])
         },
         prompt,
-        llm
+        llm,
+        StrOutputParser()
     )
@@ -1,7 +1,23 @@
+from hashlib import blake2b
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from typing import List
 
+
+def compute_chunk_id(doc: Document) -> str:
+    """
+    Compute a short, stable fingerprint of a chunk from its text, title and page.
+
+    Args:
+        doc: The chunk to fingerprint.
+
+    Returns:
+        A 32-character hex digest identifying the chunk.
+    """
+    h = blake2b(doc.page_content.encode("utf-8"), digest_size=16)
+    h.update(f"\0{doc.metadata.get('doc_title')}\0{doc.metadata.get('page')}".encode("utf-8"))
+    return h.hexdigest()
+
 def chunk_documents(docs: List[Document], chunk_size: int = 1000, chunk_overlap: int = 200) -> List[Document]:
     """
     Split documents into chunks with metadata preservation.
@@ -12,7 +28,8 @@ def chunk_documents(docs: List[Document], chunk_size: int = 1000, chunk_overlap:
         chunk_overlap: The number of characters to overlap between adjacent chunks. Defaults to 200.
 
     Returns:
-        A new list of Document objects, where each object is a text chunk with its original metadata.
+        A new list of Document objects, where each object is a text chunk with its original metadata
+        plus a "chunk_id" fingerprint.
     """
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
@@ -20,15 +37,14 @@ def chunk_documents(docs: List[Document], chunk_size: int = 1000, chunk_overlap:
         length_function=len,
         separators=["\n\n", "\n", " ", ""]  # Prioritize splitting by paragraphs, then lines, then words, then characters
     )
-    chunks = []
-    for doc in docs:
-        split_texts = splitter.split_text(doc.page_content)
-
-        # Create a new Document object for each text chunk,
-        # preserving the original metadata from the source document
-        for text in split_texts:
-            chunks.append(Document(
-                page_content=text,
-                metadata=doc.metadata  # Preserve category, doc_title, page
-            ))
-    return chunks 
\ No newline at end of file
+    # Split all pages in one batched call; each chunk gets a copy of its source
+    # page's metadata (category, doc_title, page)
+    chunks = splitter.create_documents(
+        [doc.page_content for doc in docs],
+        metadatas=[doc.metadata for doc in docs]
+    )
+
+    # Fingerprint each chunk once so retrieval can deduplicate on a short key
+    for chunk in chunks:
+        chunk.metadata["chunk_id"] = compute_chunk_id(chunk)
+    return chunks
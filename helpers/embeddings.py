@@ -0,0 +1,61 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+from typing import List, Tuple
+
+
+class BatchedQueryEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that coalesces concurrent embed_query calls into batched encodes.
+
+    Queries from concurrent sessions are queued; a background thread drains up to
+    max_batch of them (waiting at most max_wait seconds for more to arrive) and runs
+    a single model forward for the whole batch.
+    """
+
+    def __init__(self, embeddings: HuggingFaceEmbeddings, max_batch: int = 16, max_wait: float = 0.01):
+        """
+        Args:
+            embeddings (HuggingFaceEmbeddings): Embedding model used for queries and documents.
+            max_batch (int, optional): Maximum number of queries per forward. Defaults to 16.
+            max_wait (float, optional): Seconds to wait for more queries before encoding.
+                Defaults to 0.01.
+        """
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        threading.Thread(target=self._run, name="query-embedder", daemon=True).start()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents directly; indexing is already batched."""
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query as part of the next micro-batch and wait for its vector."""
+        future: Future = Future()
+        self._queue.put((text.replace("\n", " "), future))
+        return future.result()
+
+    def _run(self) -> None:
+        """Background loop: collect a micro-batch of queries, encode it, resolve futures."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            try:
+                encode_kwargs = {**self.embeddings.encode_kwargs, "batch_size": self.max_batch, "show_progress_bar": False}
+                vectors = self.embeddings.client.encode([text for text, _ in batch], **encode_kwargs)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector.tolist())
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
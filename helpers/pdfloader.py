@@ -1,40 +1,72 @@
 import os
-from langchain_community.document_loaders import PyPDFLoader
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+from multiprocessing.context import BaseContext
+import fitz  # PyMuPDF
 from langchain.schema import Document
-from typing import List
+from typing import List, Optional
 
-def load_pdfs(folder_path: str, category: str) -> List[Document]:
+def _load_one(pdf_path: str, category: str, file: str) -> List[Document]:
     """
-    Loads PDFs from a folder and adds metadata (category, title, page).
+    Loads a single PDF and adds metadata (category, title, page) to each page.
+
+    Args:
+        pdf_path: The path to the PDF file.
+        category: The category to assign to the loaded pages.
+        file: The PDF file name, used to derive the document title.
+    Returns:
+        A list of Document objects, one per page; empty if loading fails.
+    """
+    try:
+        doc_title = file.replace("_", " ").replace(".pdf", "")
+
+        # Extract each page's text with PyMuPDF (native parser) as a Document with metadata
+        with fitz.open(pdf_path) as pdf:
+            return [
+                Document(
+                    page_content=page.get_text("text"),
+                    metadata={
+                        "source": pdf_path,
+                        "category": category,
+                        "doc_title": doc_title,
+                        "page": page.number  # Zero-based, as previously reported by PyPDFLoader
+                    }
+                )
+                for page in pdf
+            ]
+    except Exception as e:
+        # Handle any errors that occur during PDF loading
+        print(f"Error loading {pdf_path}: {e}")
+        return []
+
+
+def load_pdfs(
+        folder_path: str,
+        category: str,
+        max_workers: Optional[int] = None,
+        mp_context: Optional[BaseContext] = None) -> List[Document]:
+    """
+    Loads PDFs from a folder in parallel processes and adds metadata (category, title, page).
 
     Args:
         folder_path: The path to the folder containing the PDF files.
         category: The category to assign to all loaded documents.
+        max_workers: Maximum number of worker processes. Defaults to the number of CPUs;
+            1 loads serially in the calling process (e.g. when it is already a pool worker).
+        mp_context: Multiprocessing context for the worker pool. Defaults to the platform
+            default; pass a "spawn" context when calling from a multi-threaded process.
     Returns:
         A list of Document objects, each representing a page from the PDFs with added metadata.
     """
-    docs = []
-
-    # Iterate over all files in the specified folder
-    for file in os.listdir(folder_path):
-        if not file.lower().endswith(".pdf"):   # Skep non-PDF files (case-insensitive)
-            continue
-        pdf_path = os.path.join(folder_path, file)
-        try:
-            pdf_docs = PyPDFLoader(pdf_path).load()   # Load the pages of the PDF as a list of Document objects using PyPDFLoader
-            
-            # Iterate through each page (Document) loaded from the current PDF
-            for doc in pdf_docs:
-                # Add or update metadata for each document (page)
-                doc.metadata.update({
-                    "category": category,
-                    "doc_title": file.replace("_", " ").replace(".pdf", ""),
-                    "page": doc.metadata.get("page")  # Preserve the original page number
-                })
-
-            # Extend the main docs list with processed pages    
-            docs.extend(pdf_docs)
-        except Exception as e:
-            # Handle any errors that occur during PDF loading
-            print(f"Error loading {pdf_path}: {e}")
-    return docs
+    files = [f for f in os.listdir(folder_path) if f.lower().endswith(".pdf")]   # Skip non-PDF files (case-insensitive)
+    if not files:
+        return []
+
+    paths = [os.path.join(folder_path, f) for f in files]
+    if max_workers == 1:
+        return list(chain.from_iterable(map(_load_one, paths, repeat(category), files)))
+
+    # Text extraction is CPU-bound, so each PDF is parsed in its own process
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as ex:
+        results = ex.map(_load_one, paths, repeat(category), files)
+        return list(chain.from_iterable(results))
@@ -0,0 +1,98 @@
+import os
+import numpy as np
+from langchain.schema import Document
+from typing import Dict, List, Optional
+
+# Cross-encoder used for reranking; kept here so indexing can tokenize for it without importing torch
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# File (inside the FAISS directory) holding pre-tokenized chunk texts for the reranker
+RERANK_TOKENS_FILE = "rerank_tokens.npz"
+# Document tokens kept per chunk; leaves room for the query and special tokens in 512
+DOC_MAX_TOKENS = 480
+
+
+class RerankTokens:
+    """
+    Reranker token ids of every chunk, stored as one flat array plus offsets.
+
+    Lets the reranker splice a tokenized query with cached document tokens instead
+    of re-tokenizing every candidate's text for each query.
+    """
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, chunk_ids: List[str]):
+        """
+        Args:
+            ids (np.ndarray): Concatenated token ids of all chunks.
+            offsets (np.ndarray): Start of each chunk's ids in `ids`, plus the total length.
+            chunk_ids (List[str]): chunk_id of each chunk, in the order of `offsets`.
+        """
+        self.ids = ids
+        self.offsets = offsets
+        self.positions: Dict[str, int] = {cid: i for i, cid in enumerate(chunk_ids)}
+
+    def get(self, chunk_id: Optional[str]) -> Optional[np.ndarray]:
+        """
+        Look up the token ids of a chunk.
+
+        Args:
+            chunk_id (Optional[str]): The chunk's metadata["chunk_id"].
+
+        Returns:
+            Optional[np.ndarray]: Token ids without special tokens, or None if unknown.
+        """
+        i = self.positions.get(chunk_id)
+        if i is None:
+            return None
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def load(cls, path: str) -> "RerankTokens":
+        """
+        Load token ids saved with store_rerank_tokens().
+
+        Args:
+            path (str): Path of the .npz file.
+
+        Returns:
+            RerankTokens: The loaded token cache.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays["ids"], arrays["offsets"], [str(c) for c in arrays["chunk_ids"]])
+
+
+def store_rerank_tokens(chunks: List[Document], faiss_dir: str, model_name: str) -> None:
+    """
+    Tokenize chunk texts with the reranker's tokenizer and save them next to the FAISS index.
+
+    Chunks without a metadata["chunk_id"] are skipped; the reranker tokenizes those at query time.
+
+    Args:
+        chunks (List[Document]): Chunks stored in the FAISS index.
+        faiss_dir (str): Directory of the FAISS index.
+        model_name (str): HuggingFace name of the reranker (cross-encoder) model.
+
+    Raises:
+        Exception: If tokenizing or saving fails.
+    """
+    from transformers import AutoTokenizer
+
+    try:
+        chunks = [c for c in chunks if c.metadata.get("chunk_id")]
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        token_ids = tokenizer(
+            [c.page_content for c in chunks],
+            add_special_tokens=False,  # [CLS]/[SEP] are added when splicing with the query
+            truncation=True,
+            max_length=DOC_MAX_TOKENS
+        )["input_ids"]
+
+        offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(ids) for ids in token_ids])
+        np.savez(
+            os.path.join(faiss_dir, RERANK_TOKENS_FILE),
+            ids=np.fromiter((t for ids in token_ids for t in ids), dtype=np.int32, count=int(offsets[-1])),
+            offsets=offsets,
+            chunk_ids=np.asarray([c.metadata["chunk_id"] for c in chunks], dtype=str)
+        )
+    except Exception as e:
+        raise Exception(f"Failed to store reranker tokens: {e}")
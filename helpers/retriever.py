@@ -1,83 +1,449 @@
-from helpers.vectorstore import get_vectorstore, get_bm25
+import asyncio
+import copy
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import torch
+from helpers.chunker import compute_chunk_id
+from helpers.vectorstore import get_vectorstore, get_bm25, binary_search
 from sentence_transformers import CrossEncoder
 from langchain.schema import Document
-from typing import List, Optional
+from langchain_community.vectorstores import FAISS
+from helpers.bm25 import BM25Index
+from helpers.rerank_tokens import RERANKER_MODEL, RerankTokens
+from typing import Dict, List, Optional, Tuple
+
+RERANKER_ONNX_DIR = "./reranker_onnx"  # Cache for the exported and quantized reranker
+# "onnx" (ONNX Runtime, default) or "torch" (sentence-transformers CrossEncoder, FP16 on GPU)
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "onnx")
+RERANK_BATCH_SIZE = 32   # Pairs per reranker forward pass
+RERANK_NUM_WORKERS = 0   # DataLoader workers for CrossEncoder tokenization (0 = main thread)
+
+# Process-wide reranker shared by all request threads; see load_reranker()
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+class OnnxCrossEncoder:
+    """
+    ONNX Runtime cross-encoder with a CrossEncoder-compatible predict().
+
+    Runs the int8-quantized model on CPU and the FP32 export on CUDA, where
+    dynamically quantized operators are not supported.
+    """
+
+    def __init__(self, model_name: str = RERANKER_MODEL, cache_dir: str = RERANKER_ONNX_DIR):
+        """
+        Export the cross-encoder to ONNX and quantize it to int8 (once), then load it.
+
+        Args:
+            model_name (str, optional): HuggingFace cross-encoder model name.
+                Defaults to RERANKER_MODEL.
+            cache_dir (str, optional): Directory holding the exported model and tokenizer.
+                Defaults to RERANKER_ONNX_DIR.
+        """
+        import onnxruntime as ort
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(cache_dir, "model.onnx")
+        quantized_path = os.path.join(cache_dir, "model_int8.onnx")
+        if not os.path.exists(quantized_path):
+            # Export the FP32 model to ONNX and quantize its weights to int8 in a temporary
+            # directory, then move it into place, so an interrupted or concurrent export
+            # never leaves a truncated model at cache_dir
+            parent = os.path.dirname(os.path.abspath(cache_dir))
+            tmp_dir = tempfile.mkdtemp(prefix=".reranker_onnx-", dir=parent)
+            try:
+                ORTModelForSequenceClassification.from_pretrained(model_name, export=True).save_pretrained(tmp_dir)
+                AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+                quantize_dynamic(
+                    os.path.join(tmp_dir, "model.onnx"),
+                    os.path.join(tmp_dir, "model_int8.onnx"),
+                    weight_type=QuantType.QInt8
+                )
+                if os.path.isdir(cache_dir) and not os.path.exists(quantized_path):
+                    shutil.rmtree(cache_dir)  # Incomplete export from an older version
+                try:
+                    os.replace(tmp_dir, cache_dir)
+                except OSError:
+                    if not os.path.exists(quantized_path):
+                        raise
+                    # Another process finished exporting first; use its copy
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if "CUDAExecutionProvider" in ort.get_available_providers():
+            self.session = ort.InferenceSession(
+                model_path, options, providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
+            )
+        else:
+            self.session = ort.InferenceSession(quantized_path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(cache_dir)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def predict(self, pairs: List[Tuple[str, str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """
+        Score (query, document) pairs.
+
+        Args:
+            pairs (List[Tuple[str, str]]): Pairs of (query, document text).
+            batch_size (int, optional): Number of pairs per forward pass. Defaults to 32.
+            **kwargs: Ignored; accepted for compatibility with CrossEncoder.predict.
+
+        Returns:
+            np.ndarray: Sigmoid relevance score per pair, as CrossEncoder returns.
+        """
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            features = self.tokenizer(
+                [q for q, _ in batch],
+                [d for _, d in batch],
+                padding=True,
+                truncation=True,
+                max_length=512,
+                pad_to_multiple_of=8,  # Keep sequence length aligned to SIMD-friendly GEMM tiles
+                return_tensors="np"
+            )
+            scores.append(self.predict_features(features))
+        return np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+    def predict_features(self, features: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Score one batch of already tokenized pairs.
+
+        Args:
+            features (Dict[str, np.ndarray]): Tokenizer outputs (input_ids, attention_mask,
+                token_type_ids) of shape (batch, seq_len).
+
+        Returns:
+            np.ndarray: Sigmoid relevance score per pair.
+        """
+        inputs = {name: value.astype(np.int64) for name, value in features.items() if name in self.input_names}
+        logits = self.session.run(None, inputs)[0]
+        return 1 / (1 + np.exp(-logits[:, 0]))
+
+
+def _load_onnx_reranker() -> OnnxCrossEncoder:
+    """Load the ONNX Runtime reranker."""
+    return OnnxCrossEncoder(RERANKER_MODEL)
+
+
+def _load_torch_reranker() -> CrossEncoder:
+    """Load the PyTorch CrossEncoder in eval mode, in half precision when running on GPU."""
+    reranker = CrossEncoder(RERANKER_MODEL)
+    if torch.cuda.is_available():
+        reranker.model.half()
+    reranker.model.eval()
+    return reranker
+
+
+def _set_torch_threads() -> None:
+    """
+    Limit torch intra-op threads to the CPUs this process may run on.
+
+    Torch defaults to the physical core count, which ignores CPU affinity (e.g. container
+    CPU sets); explicit OMP_NUM_THREADS / MKL_NUM_THREADS settings are left untouched.
+    """
+    if os.getenv("OMP_NUM_THREADS") or os.getenv("MKL_NUM_THREADS"):
+        return
+    if hasattr(os, "sched_getaffinity"):
+        torch.set_num_threads(max(1, min(torch.get_num_threads(), len(os.sched_getaffinity(0)))))
+
+
+def _load_selected_reranker():
+    """Load the reranker for RERANKER_BACKEND, falling back to PyTorch."""
+    if RERANKER_BACKEND == "onnx":
+        try:
+            return _load_onnx_reranker()
+        except ImportError:
+            pass  # optimum/onnxruntime not installed
+        except Exception as e:
+            # Export/quantization or session creation failed (no network, unwritable cache, ...)
+            print(f"ONNX reranker unavailable, using PyTorch CrossEncoder: {e}")
+    return _load_torch_reranker()
+
 
 def load_reranker():
     """
-    Load cross-encoder for reranking.
+    Load cross-encoder for reranking, once per process.
+
+    Uses ONNX Runtime unless RERANKER_BACKEND=torch, and falls back to the PyTorch
+    CrossEncoder when optimum/onnxruntime are not installed or the ONNX model cannot
+    be exported or loaded.
+
+    The instance is a lock-guarded singleton shared by concurrent request threads.
+    The Hugging Face fast tokenizer is the one stateful part: each call with
+    different padding/truncation settings reconfigures it in place, which races
+    across threads. So the query-only path (_predict_tokens) gets its own tokenizer
+    copy, and both tokenizers are run once here, under the lock, so their settings
+    are fixed before any request thread uses them.
+
+    Separate worker processes (e.g. uvicorn --workers N) each load their own copy,
+    so reranker memory scales with the number of processes.
+    """
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:  # Another thread may have loaded it while we waited
+                _set_torch_threads()
+                reranker = _load_selected_reranker()
+                reranker.query_tokenizer = copy.deepcopy(reranker.tokenizer)
+                reranker.predict([("warm up", "warm up")], show_progress_bar=False)
+                reranker.query_tokenizer("warm up", add_special_tokens=False)
+                _reranker = reranker
+    return _reranker
+
+
+def _splice_features(tokenizer, query_ids: List[int], doc_ids: List[np.ndarray], max_length: int = 512) -> Dict[str, np.ndarray]:
     """
-    return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+    Build a padded batch of [CLS] query [SEP] doc [SEP] inputs from token ids.
 
+    Args:
+        tokenizer: The reranker's tokenizer (for special and padding token ids).
+        query_ids (List[int]): Query token ids without special tokens.
+        doc_ids (List[np.ndarray]): Pre-tokenized document ids without special tokens.
+        max_length (int, optional): Maximum sequence length. Defaults to 512.
 
-def hybrid_search(query: str, top_n: int = 20, filters: Optional[dict] = None) -> List[Document]:
+    Returns:
+        Dict[str, np.ndarray]: input_ids, attention_mask and token_type_ids of shape (batch, seq_len).
     """
-    Perform hybrid search by combining FAISS (dense) and BM25 (sparse) retrievers.
+    query_ids = query_ids[:max_length // 2]
+    doc_ids = [d[:max_length - 3 - len(query_ids)] for d in doc_ids]
+    # Pad to a multiple of 8, as tokenizer(pad_to_multiple_of=8) does in predict()
+    seq_len = -(-(len(query_ids) + 3 + max(len(d) for d in doc_ids)) // 8) * 8
+
+    input_ids = np.full((len(doc_ids), seq_len), tokenizer.pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(doc_ids), seq_len), dtype=np.int64)
+    token_type_ids = np.zeros((len(doc_ids), seq_len), dtype=np.int64)
+    prefix = [tokenizer.cls_token_id, *query_ids, tokenizer.sep_token_id]
+    for row, ids in enumerate(doc_ids):
+        end = len(prefix) + len(ids) + 1
+        input_ids[row, :len(prefix)] = prefix
+        input_ids[row, len(prefix):end - 1] = ids
+        input_ids[row, end - 1] = tokenizer.sep_token_id
+        attention_mask[row, :end] = 1
+        token_type_ids[row, len(prefix):end] = 1  # Second segment: document and final [SEP]
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+
+
+def _predict_tokens(reranker, query: str, doc_ids: List[np.ndarray], batch_size: int) -> np.ndarray:
+    """
+    Score a query against pre-tokenized documents, tokenizing only the query.
+
+    Args:
+        reranker: Reranker returned by load_reranker().
+        query (str): The search query string.
+        doc_ids (List[np.ndarray]): Pre-tokenized document ids without special tokens.
+        batch_size (int): Pairs per forward pass.
+
+    Returns:
+        np.ndarray: Sigmoid relevance score per document.
+    """
+    # Own tokenizer copy: calling the shared one without padding/truncation would
+    # reconfigure it under concurrent predict() calls (see load_reranker)
+    query_ids = reranker.query_tokenizer(query, add_special_tokens=False)["input_ids"]
+    scores = []
+    for start in range(0, len(doc_ids), batch_size):
+        features = _splice_features(reranker.tokenizer, query_ids, doc_ids[start:start + batch_size])
+        if isinstance(reranker, OnnxCrossEncoder):
+            scores.append(reranker.predict_features(features))
+        else:
+            # Call the CrossEncoder's underlying transformer directly, bypassing predict()
+            inputs = {name: torch.from_numpy(value).to(reranker.model.device) for name, value in features.items()}
+            # inference_mode is thread-local, so it is entered here rather than set globally at import
+            with torch.inference_mode():
+                logits = reranker.model(**inputs).logits[:, 0]
+            scores.append(torch.sigmoid(logits.float()).cpu().numpy())
+    return np.concatenate(scores)
+
+
+def dense_search(faiss_store: FAISS, query: str, top_n: int, filters: Optional[dict] = None) -> List[Document]:
+    """
+    Retrieve top-N documents from the FAISS vectorstore.
+
+    Uses binary Hamming recall when a binary index is stored with the vectorstore.
 
     Args:
+        faiss_store (FAISS): Loaded FAISS vectorstore.
         query (str): Search query string.
-        top_n (int, optional): Maximum number of results to retrieve from
-            each retriever. Defaults to 20.
-        filters (Optional[Dict], optional): Metadata filters for FAISS retriever.
-            Defaults to None.
+        top_n (int): Maximum number of documents to retrieve.
+        filters (Optional[Dict], optional): Metadata filters. Defaults to None.
 
     Returns:
-        List[Document]: A merged and deduplicated list of retrieved documents.
+        List[Document]: Retrieved documents, most similar first.
     """
-    faiss_store = get_vectorstore()
-    bm25 = get_bm25()
+    if getattr(faiss_store, "binary_index", None) is not None:
+        return binary_search(faiss_store, query, top_n, filters=filters)
+    gpu_lock = getattr(faiss_store, "gpu_lock", None)
+    if gpu_lock is None:
+        # Query the store directly rather than building a retriever wrapper per call
+        return faiss_store.similarity_search(query, k=top_n, filter=filters)
 
-    # Retrieve top-N documents from FAISS 
-    dense_docs = faiss_store.as_retriever(search_kwargs={"k": top_n, "filter": filters}).invoke(query)
-    # Retrieve top-N documents from BM25
-    sparse_docs = bm25.invoke(query)[:top_n]
+    # GPU indexes are not thread-safe: embed outside the lock (so concurrent queries still
+    # micro-batch), then serialize only the index search
+    embedding = faiss_store.embedding_function.embed_query(query)
+    with gpu_lock:
+        return faiss_store.similarity_search_by_vector(embedding, k=top_n, filter=filters)
 
-    # Merge and deduplicate by (content + title + page) to avoid redundancy
+
+def _merge_results(dense_docs: List[Document], sparse_docs: List[Document]) -> List[Document]:
+    """Merge dense and sparse results, keeping the first occurrence of each chunk."""
+    # Merge and deduplicate by chunk fingerprint (content + title + page) to avoid redundancy;
+    # chunks indexed before chunk_id existed are fingerprinted on the fly
     merged = []
     seen = set()
     for doc in dense_docs + sparse_docs:
-        key = (
-            doc.page_content, 
-            doc.metadata.get("doc_title"), 
-            doc.metadata.get("page")
-        )
+        key = doc.metadata.get("chunk_id") or compute_chunk_id(doc)
         if key not in seen:
             seen.add(key)
             merged.append(doc)
 
     return merged
 
-def rerank(query: str, docs: List[Document]) -> List[Document]:
+
+async def hybrid_search_async(
+        query: str,
+        top_n: int = 20,
+        filters: Optional[dict] = None,
+        faiss_store: Optional[FAISS] = None,
+        bm25: Optional[BM25Index] = None
+        ) -> List[Document]:
+    """
+    Perform hybrid search by combining FAISS (dense) and BM25 (sparse) retrievers.
+
+    Both retrievers run concurrently in worker threads, so latency is
+    max(dense, sparse) rather than their sum.
+
+    Args:
+        query (str): Search query string.
+        top_n (int, optional): Maximum number of results to retrieve from
+            each retriever. Defaults to 20.
+        filters (Optional[Dict], optional): Metadata filters for FAISS retriever.
+            Defaults to None.
+        faiss_store (Optional[FAISS], optional): Preloaded FAISS vectorstore.
+            Defaults to loading the default store from disk.
+        bm25 (Optional[BM25Index], optional): Preloaded BM25 index.
+            Defaults to loading the default retriever from disk.
+
+    Returns:
+        List[Document]: A merged and deduplicated list of retrieved documents.
+    """
+    if faiss_store is None:
+        faiss_store = get_vectorstore()
+    if bm25 is None:
+        bm25 = get_bm25()
+
+    dense_docs, sparse_docs = await asyncio.gather(
+        # Retrieve top-N documents from FAISS
+        asyncio.to_thread(dense_search, faiss_store, query, top_n, filters),
+        # Retrieve BM25's default k documents (capped at top_n), as the original
+        # BM25Retriever did, so the reranker's candidate count is unchanged
+        asyncio.to_thread(bm25.invoke, query, min(bm25.k, top_n))
+    )
+    return _merge_results(dense_docs, sparse_docs)
+
+
+def hybrid_search(
+        query: str,
+        top_n: int = 20,
+        filters: Optional[dict] = None,
+        faiss_store: Optional[FAISS] = None,
+        bm25: Optional[BM25Index] = None
+        ) -> List[Document]:
+    """
+    Synchronous wrapper around hybrid_search_async.
+
+    Args:
+        query (str): Search query string.
+        top_n (int, optional): Maximum number of results to retrieve from
+            each retriever. Defaults to 20.
+        filters (Optional[Dict], optional): Metadata filters for FAISS retriever.
+            Defaults to None.
+        faiss_store (Optional[FAISS], optional): Preloaded FAISS vectorstore. Defaults to None.
+        bm25 (Optional[BM25Index], optional): Preloaded BM25 index. Defaults to None.
+
+    Returns:
+        List[Document]: A merged and deduplicated list of retrieved documents.
+    """
+    return asyncio.run(hybrid_search_async(query, top_n=top_n, filters=filters, faiss_store=faiss_store, bm25=bm25))
+
+def rerank(
+        query: str,
+        docs: List[Document],
+        batch_size: int = RERANK_BATCH_SIZE,
+        num_workers: int = RERANK_NUM_WORKERS,
+        doc_tokens: Optional[RerankTokens] = None,
+        k: Optional[int] = None
+        ) -> List[Document]:
     """
     Rerank retrieved documents by semantic relevance using a cross-encoder.
 
     Args:
         query (str): The search query string.
         docs (List[Document]): List of candidate documents.
+        batch_size (int, optional): Pairs per reranker forward pass. Defaults to RERANK_BATCH_SIZE.
+        num_workers (int, optional): DataLoader workers for the PyTorch reranker.
+            Defaults to RERANK_NUM_WORKERS.
+        doc_tokens (Optional[RerankTokens], optional): Pre-tokenized chunk texts. When every
+            candidate is found in it, only the query is tokenized. Defaults to None.
+        k (Optional[int], optional): Return only the k most relevant documents.
+            Defaults to None (all documents).
 
     Returns:
         List[Document]: Documents sorted by descending relevance score.
     """
+    if not docs:
+        return []
+
     reranker = load_reranker()
-    # Create pairs of (query, document content) for reranking
-    pairs = [(query, d.page_content) for d in docs]
-    scores = reranker.predict(pairs)
+    scores = np.empty(len(docs), dtype=np.float32)
 
-    # Sort documents by relevance score (highest first)
-    return [
-        doc for _, doc in sorted(
-            zip(scores, docs), 
-            key=lambda x: x[0], 
-            reverse=True)]
+    doc_ids = [doc_tokens.get(d.metadata.get("chunk_id")) for d in docs] if doc_tokens is not None else None
+    if doc_ids is not None and all(ids is not None for ids in doc_ids):
+        # Splice the tokenized query with cached document tokens, longest first (as below)
+        order = np.argsort([-len(ids) for ids in doc_ids], kind="stable")
+        scores[order] = _predict_tokens(reranker, query, [doc_ids[i] for i in order], batch_size)
+    else:
+        # Create pairs of (query, document content) for reranking, longest documents first
+        # so each batch pads to similar lengths instead of to the longest doc overall
+        order = np.argsort([-len(d.page_content) for d in docs], kind="stable")
+        pairs = [(query, docs[i].page_content) for i in order]
+        # Score all pairs in full batches rather than one forward pass per pair
+        scores[order] = reranker.predict(
+            pairs,
+            batch_size=min(len(pairs), batch_size),
+            num_workers=num_workers,
+            show_progress_bar=False,
+            convert_to_numpy=True
+        )
 
-def hybrid_search_with_rerank(
+    # Select the top-k by relevance score in O(n), then sort only those (highest first,
+    # ties in retrieval order)
+    k = len(docs) if k is None else min(k, len(docs))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.lexsort((top, -scores[top]))]
+    return [docs[i] for i in top]
+
+async def hybrid_search_with_rerank_async(
         query: str, 
         k: int = 6, 
         filters: Optional[dict] = None, 
-        rerank_top_n: int = 20
+        rerank_top_n: int = 20,
+        faiss_store: Optional[FAISS] = None,
+        bm25: Optional[BM25Index] = None,
+        batch_size: int = RERANK_BATCH_SIZE
         ) -> List[Document]:
     """
-    Hybrid search pipeline with reranking.
+    Hybrid search pipeline with reranking, for use from async code.
 
     Args:
         query (str): The search query string.
@@ -85,15 +451,56 @@ def hybrid_search_with_rerank(
         filters (Optional[Dict], optional): Metadata filters for FAISS retriever. Defaults to None.
         rerank_top_n (int, optional): Number of documents to retrieve before reranking.
             Defaults to 20.
+        faiss_store (Optional[FAISS], optional): Preloaded FAISS vectorstore. Defaults to None.
+        bm25 (Optional[BM25Index], optional): Preloaded BM25 index. Defaults to None.
+        batch_size (int, optional): Pairs per reranker forward pass. Defaults to RERANK_BATCH_SIZE.
 
     Returns:
         List[Document]: Top-k reranked documents most relevant to the query.
     """
+    if faiss_store is None:
+        faiss_store = get_vectorstore()
+
     # Step 1: Perform hybrid retrieval
-    docs = hybrid_search(query, top_n=rerank_top_n, filters=filters)
+    docs = await hybrid_search_async(query, top_n=rerank_top_n, filters=filters, faiss_store=faiss_store, bm25=bm25)
+    if len(docs) <= k:
+        return docs  # Every candidate is returned anyway, so skip the reranker forward pass
+
+    # Step 2: Rerank retrieved documents by semantic relevance (off the event loop),
+    # reusing document tokens cached with the vectorstore when available
+    reranked = await asyncio.to_thread(
+        rerank, query, docs, batch_size, doc_tokens=getattr(faiss_store, "rerank_tokens", None), k=k
+    )
 
-    # Step 2: Rerank retrieved documents by semantic relevance
-    reranked = rerank(query, docs)
+    # Step 3: Return top-k reranked documents (rerank already selected only k)
+    return reranked
 
-    # Step 3: Return top-k reranked documents
-    return reranked[:k]
\ No newline at end of file
+
+def hybrid_search_with_rerank(
+        query: str, 
+        k: int = 6, 
+        filters: Optional[dict] = None, 
+        rerank_top_n: int = 20,
+        faiss_store: Optional[FAISS] = None,
+        bm25: Optional[BM25Index] = None,
+        batch_size: int = RERANK_BATCH_SIZE
+        ) -> List[Document]:
+    """
+    Hybrid search pipeline with reranking.
+
+    Args:
+        query (str): The search query string.
+        k (int, optional): Number of top reranked documents to return. Defaults to 6.
+        filters (Optional[Dict], optional): Metadata filters for FAISS retriever. Defaults to None.
+        rerank_top_n (int, optional): Number of documents to retrieve before reranking.
+            Defaults to 20.
+        faiss_store (Optional[FAISS], optional): Preloaded FAISS vectorstore. Defaults to None.
+        bm25 (Optional[BM25Index], optional): Preloaded BM25 index. Defaults to None.
+        batch_size (int, optional): Pairs per reranker forward pass. Defaults to RERANK_BATCH_SIZE.
+
+    Returns:
+        List[Document]: Top-k reranked documents most relevant to the query.
+    """
+    return asyncio.run(hybrid_search_with_rerank_async(
+        query, k=k, filters=filters, rerank_top_n=rerank_top_n, faiss_store=faiss_store, bm25=bm25, batch_size=batch_size
+    ))
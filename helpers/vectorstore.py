@@ -1,14 +1,119 @@
+import math
+import os
 import pickle
+import sqlite3
+import threading
+import uuid
+from functools import lru_cache
+import faiss
+import numpy as np
+import torch
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.retrievers import BM25Retriever
+from helpers.bm25 import BM25Index
+from helpers.embeddings import BatchedQueryEmbeddings
+from helpers.rerank_tokens import RERANK_TOKENS_FILE, RerankTokens
 from langchain.schema import Document
-from typing import List
+from typing import List, Optional
 
+# File (inside the FAISS directory) holding the optional 1-bit-per-dimension recall index
+BINARY_INDEX_FILE = "index_binary.faiss"
+# HNSW graph parameters: neighbours per node and build/search beam widths
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 128
+HNSW_EF_SEARCH = 64
 
-def store_chunks(chunks: List[Document], faiss_dir: str = "./faiss_store", embeddings_model: str = "sentence-transformers/all-MiniLM-L6-v2") -> FAISS:
+# Corpora above this size keep HNSW vectors as 8-bit scalar-quantized codes (4x smaller)
+HNSWSQ_MIN_VECTORS = 10_000
+# Corpora above this size are stored as IVF+PQ codes instead of full-precision vectors
+IVFPQ_MIN_VECTORS = 50_000
+IVFPQ_M = 16        # Sub-quantizers per vector (16 bytes per code at 8 bits each)
+IVFPQ_NBITS = 8
+# Inverted lists visited per query, stored with the index and (re)applied once at load;
+# covers the deepest rerank_top_n the app offers (50) without per-request writes
+IVFPQ_SEARCH_NPROBE = 50
+
+INDEX_BATCH_SIZE = 256  # Chunks per forward pass when embedding the corpus
+EMBED_BATCH_SIZE = 128  # Default texts per forward pass for other embedding calls
+
+# Move loaded flat/IVF indexes to GPU when FAISS was built with GPU support ("1" enables)
+USE_GPU_FAISS = os.getenv("USE_GPU_FAISS", "0") == "1"
+# Memory-map FAISS index files read-only instead of reading them onto the heap, so the
+# OS page cache is shared between worker processes ("1" enables)
+FAISS_MMAP = os.getenv("FAISS_MMAP", "0") == "1"
+
+
+@lru_cache(maxsize=4)
+def _get_embeddings(model_name: str) -> HuggingFaceEmbeddings:
+    """Load a HuggingFace embedding model once per process (on GPU when available)."""
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": "cuda" if torch.cuda.is_available() else "cpu"},
+        # Normalize like the corpus vectors written by store_chunks
+        encode_kwargs={"batch_size": EMBED_BATCH_SIZE, "normalize_embeddings": True}
+    )
+
+
+@lru_cache(maxsize=4)
+def _get_query_embeddings(model_name: str) -> BatchedQueryEmbeddings:
+    """Shared micro-batching query embedder wrapping the cached embedding model."""
+    return BatchedQueryEmbeddings(_get_embeddings(model_name))
+
+
+def build_index(xb: np.ndarray) -> faiss.Index:
+    """
+    Build an approximate nearest-neighbour FAISS index over embeddings.
+
+    Small corpora use an HNSW graph over full-precision vectors; above
+    HNSWSQ_MIN_VECTORS the graph stores int8 scalar-quantized vectors, and above
+    IVFPQ_MIN_VECTORS vectors are kept as compact IVF+PQ product-quantized codes.
+
+    Args:
+        xb (np.ndarray): Float32 matrix of shape (n_vectors, dim).
+
+    Returns:
+        faiss.Index: A trained and populated FAISS index.
+    """
+    n, d = xb.shape
+    if n > IVFPQ_MIN_VECTORS:
+        # Coarse quantizer uses L2 to match the distance strategy of the LangChain FAISS store
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, max(1, int(4 * math.sqrt(n))), IVFPQ_M, IVFPQ_NBITS)
+        index.train(xb)
+        index.add(xb)
+        index.nprobe = IVFPQ_SEARCH_NPROBE
+        return index
+
+    if n > HNSWSQ_MIN_VECTORS:
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+        index.train(xb)  # Learns the per-dimension value ranges for the 8-bit codes
+    else:
+        index = faiss.IndexHNSWFlat(d, HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.add(xb)
+    return index
+
+
+def build_binary_index(xb: np.ndarray) -> faiss.IndexBinary:
+    """
+    Build a Hamming-distance FAISS index over sign-binarized embeddings.
+
+    Args:
+        xb (np.ndarray): Float32 matrix of shape (n_vectors, dim); dim must be a multiple of 8.
+
+    Returns:
+        faiss.IndexBinary: An IndexBinaryFlat holding one bit per embedding dimension.
+    """
+    index = faiss.IndexBinaryFlat(xb.shape[1])
+    index.add(np.packbits((xb > 0).astype(np.uint8), axis=1))
+    return index
+
+
+def store_chunks(chunks: List[Document], faiss_dir: str = "./faiss_store", embeddings_model: str = "sentence-transformers/all-MiniLM-L6-v2", binary_recall: bool = False) -> FAISS:
     """
-     Build and store a FAISS vectorstore using HuggingFace embeddings.
+     Build and store a FAISS (HNSW) vectorstore using HuggingFace embeddings.
 
     Args:
         chunks (List[Document]): List of document chunks to index.
@@ -16,6 +121,8 @@ def store_chunks(chunks: List[Document], faiss_dir: str = "./faiss_store", embed
             Defaults to "./faiss_store".
         embeddings_model (str, optional): Name of HuggingFace embedding model to use.
             Defaults to "sentence-transformers/all-MiniLM-L6-v2".
+        binary_recall (bool, optional): Also store a binary (Hamming) index used for
+            first-stage dense recall. Defaults to False.
 
     Returns:
         FAISS: A FAISS vectorstore object containing indexed chunks.
@@ -23,44 +130,127 @@ def store_chunks(chunks: List[Document], faiss_dir: str = "./faiss_store", embed
     Raises:
         Exception: If storing FAISS index fails.
     """
-    embeddings = HuggingFaceEmbeddings(model_name=embeddings_model)
-    
-    
+    embeddings = _get_embeddings(embeddings_model)
+
     try:
-        vectorstore = FAISS.from_documents(chunks, embeddings) # Build FAISS vectorstore from documents
+        # Embed all chunks in one large-batch encode (FP16 autocast on GPU) and build an
+        # approximate index instead of a flat (exhaustive) one
+        device = embeddings.client.device.type
+        with torch.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+            xb = embeddings.client.encode(
+                [c.page_content for c in chunks],
+                batch_size=INDEX_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=True
+            ).astype("float32")
+        index = build_index(xb)
+
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        vectorstore = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=InMemoryDocstore(dict(zip(ids, chunks))),
+            index_to_docstore_id=dict(enumerate(ids))
+        )
         vectorstore.save_local(faiss_dir) # Save FAISS index to disk for reuse
+
+        if binary_recall:
+            vectorstore.binary_index = build_binary_index(xb)
+            faiss.write_index_binary(vectorstore.binary_index, os.path.join(faiss_dir, BINARY_INDEX_FILE))
+        return vectorstore
     except Exception as e:
         raise Exception(f"Failed to store FAISS index: {e}")
 
 
 
-def get_bm25_retriever(chunks: List[Document], bm25_file: str = "chunks_bm25.pkl") -> BM25Retriever:
+def store_chunk_db(chunks: List[Document], db_file: str = "chunks.sqlite") -> None:
+    """
+    Save chunk text and metadata into an SQLite table indexed by category.
+
+    Readers that need only a few chunks or only metadata (e.g. the category list)
+    can query rows directly instead of unpickling every Document.
+
+    Args:
+        chunks (List[Document]): List of document chunks to save.
+        db_file (str, optional): Output SQLite database path. Defaults to "chunks.sqlite".
+
+    Raises:
+        Exception: If writing the database fails.
     """
-    Build and save a BM25 retriever from document chunks.
+    try:
+        if os.path.exists(db_file):
+            os.remove(db_file)  # Rebuild from scratch so stale chunks never linger
+        with sqlite3.connect(db_file) as conn:
+            conn.execute(
+                "CREATE TABLE chunks (id INTEGER PRIMARY KEY, category TEXT, doc_title TEXT, page INTEGER, text TEXT)"
+            )
+            conn.execute("CREATE INDEX idx_chunks_category ON chunks (category)")
+            conn.executemany(
+                "INSERT INTO chunks (id, category, doc_title, page, text) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (i, c.metadata.get("category"), c.metadata.get("doc_title"), c.metadata.get("page"), c.page_content)
+                    for i, c in enumerate(chunks)
+                )
+            )
+        conn.close()
+    except Exception as e:
+        raise Exception(f"Failed to store chunk database: {e}")
+
+
+
+def get_categories(db_file: str = "chunks.sqlite") -> List[str]:
+    """
+    List the distinct document categories stored in a chunk database.
+
+    Args:
+        db_file (str, optional): SQLite database written by store_chunk_db.
+            Defaults to "chunks.sqlite".
+
+    Returns:
+        List[str]: Sorted list of non-empty categories.
+    """
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT DISTINCT category FROM chunks WHERE category IS NOT NULL AND category != '' ORDER BY category")
+        return [row[0] for row in rows]
+    finally:
+        conn.close()
+
+
+
+def get_bm25_retriever(chunks: List[Document], bm25_dir: str = "chunks_bm25") -> BM25Index:
+    """
+    Build and save a BM25 index from document chunks.
 
     Args:
         chunks (List[Document]): List of document chunks to index.
-        bm25_file (str, optional): File path where the retriever will be pickled.
-            Defaults to "chunks_bm25.pkl".
+        bm25_dir (str, optional): Directory where the index arrays will be saved.
+            Defaults to "chunks_bm25".
 
     Returns:
-        BM25Retriever: A BM25 retriever object for keyword-based retrieval.
+        BM25Index: A sparse-matrix BM25 index for keyword-based retrieval.
 
     Raises:
-        Exception: If creating or saving BM25 retriever fails.
+        Exception: If creating or saving BM25 index fails.
     """
     try:
-        bm25 = BM25Retriever.from_documents(chunks)
-        with open(bm25_file, "wb") as f: # Save BM25 retriever to disk for reuse
-            pickle.dump(bm25, f)
+        bm25 = BM25Index.from_documents(chunks)
+        bm25.save(bm25_dir) # Save BM25 arrays to disk for reuse
+        return bm25
     except Exception as e:
         raise Exception(f"Failed to create BM25 retriever: {e}")
 
 
 
+@lru_cache(maxsize=4)
 def get_vectorstore(faiss_dir: str = "./chunks_faiss_store", embeddings_model: str = "sentence-transformers/all-MiniLM-L6-v2") -> FAISS:
     """
-    Load an existing FAISS vectorstore from disk.
+    Load an existing FAISS vectorstore from disk, once per directory per process.
+
+    When FAISS_MMAP is set, the index file is memory-mapped read-only (for index types
+    FAISS can map; others are read normally). When USE_GPU_FAISS is set and a GPU is
+    visible to FAISS, flat and IVF indexes are moved to GPU (see index_to_gpu).
 
     Args:
         faiss_dir (str, optional): Directory where FAISS index is stored.
@@ -75,29 +265,145 @@ def get_vectorstore(faiss_dir: str = "./chunks_faiss_store", embeddings_model: s
         Exception: If loading FAISS index fails.
     """
     try:
-        embeddings = HuggingFaceEmbeddings(model_name=embeddings_model)
-        return FAISS.load_local(faiss_dir, embeddings, allow_dangerous_deserialization=True)
+        # Queries are embedded on GPU when available, micro-batched across concurrent sessions
+        embeddings = _get_query_embeddings(embeddings_model)
+        if FAISS_MMAP:
+            # Same files as FAISS.load_local, but the index is mapped rather than read
+            index = faiss.read_index(os.path.join(faiss_dir, "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            with open(os.path.join(faiss_dir, "index.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            vectorstore = FAISS(embeddings, index, docstore, index_to_docstore_id)
+        else:
+            vectorstore = FAISS.load_local(faiss_dir, embeddings, allow_dangerous_deserialization=True)
+
+        # Attach the binary recall index when one was stored alongside the main index
+        binary_path = os.path.join(faiss_dir, BINARY_INDEX_FILE)
+        if os.path.exists(binary_path):
+            vectorstore.binary_index = faiss.read_index_binary(binary_path)
+
+        # Attach pre-tokenized chunk texts so the reranker only tokenizes queries
+        tokens_path = os.path.join(faiss_dir, RERANK_TOKENS_FILE)
+        if os.path.exists(tokens_path):
+            vectorstore.rerank_tokens = RerankTokens.load(tokens_path)
+
+        set_search_params(vectorstore)  # Before any GPU clone, which copies nprobe
+        if USE_GPU_FAISS:
+            index_to_gpu(vectorstore)
+        return vectorstore
     except Exception as e:
         raise Exception(f"Failed to load FAISS index: {e}")
 
 
 
-def get_bm25(bm25_file: str = "chunks_bm25.pkl") -> BM25Retriever:
+def binary_search(vectorstore: FAISS, query: str, k: int, filters: Optional[dict] = None) -> List[Document]:
     """
-     Load a BM25 retriever from disk.
+    Retrieve candidate documents by Hamming distance over the binary recall index.
+
+    Args:
+        vectorstore (FAISS): FAISS vectorstore with an attached binary_index.
+        query (str): Search query string.
+        k (int): Number of candidate documents to return.
+        filters (Optional[dict], optional): Metadata key/value pairs a document must
+            match. Defaults to None.
+
+    Returns:
+        List[Document]: Up to k candidate documents, nearest first.
+    """
+    xq = np.asarray([vectorstore.embedding_function.embed_query(query)], dtype="float32")
+    xq_bin = np.packbits((xq > 0).astype(np.uint8), axis=1)
+
+    # Over-fetch when filtering so enough candidates survive the metadata check
+    fetch_k = min(k * 4 if filters else k, vectorstore.binary_index.ntotal)
+    _, ids = vectorstore.binary_index.search(xq_bin, fetch_k)
+
+    docs = []
+    for i in ids[0]:
+        if i == -1:
+            continue
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+        if filters and any(doc.metadata.get(key) != value for key, value in filters.items()):
+            continue
+        docs.append(doc)
+        if len(docs) == k:
+            break
+    return docs
+
+
+def index_to_gpu(vectorstore: FAISS) -> FAISS:
+    """
+    Move the FAISS index of a vectorstore to the first GPU when one is available.
+
+    Only flat and IVF indexes (corpora above IVFPQ_MIN_VECTORS) can be cloned to GPU;
+    HNSW indexes, used for smaller corpora, are left on CPU. Vectors are stored in
+    float16 on the GPU, halving memory and bandwidth.
+
+    GPU indexes and their resources are not thread-safe, so the vectorstore also gets
+    a gpu_lock that callers must hold while searching it.
+
+    Args:
+        vectorstore (FAISS): Loaded FAISS vectorstore with a CPU index.
+
+    Returns:
+        FAISS: The same vectorstore, with its index on GPU if possible.
+    """
+    if not isinstance(faiss.downcast_index(vectorstore.index), (faiss.IndexFlat, faiss.IndexIVF)):
+        return vectorstore  # Not implemented on GPU by FAISS (e.g. HNSW)
+
+    try:
+        if faiss.get_num_gpus() > 0:
+            res = faiss.StandardGpuResources()
+            co = faiss.GpuClonerOptions()
+            co.useFloat16 = True
+            vectorstore.index = faiss.index_cpu_to_gpu(res, 0, vectorstore.index, co)
+            vectorstore.gpu_resources = res  # Keep GPU memory alive as long as the index
+            vectorstore.gpu_lock = threading.Lock()
+    except Exception as e:
+        # CPU-only FAISS builds stay on CPU
+        print(f"GPU FAISS unavailable, using CPU index: {e}")
+    return vectorstore
+
+
+def set_search_params(vectorstore: FAISS, nprobe: int = IVFPQ_SEARCH_NPROBE) -> None:
+    """
+    Set approximate-search parameters of the FAISS index for serving.
+
+    Called once when the index is loaded: the index is shared by all sessions, so
+    per-request writes would let concurrent queries search with each other's values.
+
+    Args:
+        vectorstore (FAISS): Loaded FAISS vectorstore.
+        nprobe (int, optional): Inverted lists visited per query (IVF indexes only).
+            Defaults to IVFPQ_SEARCH_NPROBE.
+    """
+    index = vectorstore.index
+    if hasattr(index, "nprobe"):
+        index.nprobe = nprobe
+
+
+
+@lru_cache(maxsize=4)
+def get_bm25(bm25_dir: str = "chunks_bm25") -> BM25Index:
+    """
+     Load a BM25 index from disk, once per directory per process.
+
+    Index arrays are memory-mapped, so loading does not read them up front. Falls
+    back to a legacy pickled BM25Retriever at the same path plus a .pkl extension,
+    rebuilding the sparse index from its documents.
 
     Args:
-        bm25_file (str, optional): File path where the retriever was saved.
-            Defaults to "chunks_bm25.pkl".
+        bm25_dir (str, optional): Directory where the index was saved.
+            Defaults to "chunks_bm25".
 
     Returns:
-        BM25Retriever: A loaded BM25 retriever object.
+        BM25Index: A loaded BM25 index.
 
     Raises:
-        Exception: If loading BM25 retriever fails.
+        Exception: If loading BM25 index fails.
     """
     try:
-        with open(bm25_file, "rb") as f:
-            return pickle.load(f)
+        if os.path.isdir(bm25_dir):
+            return BM25Index.load(bm25_dir)
+        with open(bm25_dir + ".pkl", "rb") as f:
+            return BM25Index.from_documents(pickle.load(f).docs)
     except Exception as e:
         raise Exception(f"Failed to load BM25 retriever: {e}")
@@ -1,12 +1,42 @@
+import argparse
 import os
 import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import BaseContext
 from helpers.pdfloader import load_pdfs
 from helpers.chunker import chunk_documents
-from helpers.vectorstore import store_chunks, get_bm25_retriever
+from helpers.vectorstore import store_chunks, get_bm25_retriever, store_chunk_db
+from helpers.rerank_tokens import RERANKER_MODEL, store_rerank_tokens
+from langchain.schema import Document
+from typing import List, Optional
+
+def _load_and_chunk(
+        folder: str,
+        category: str,
+        max_workers: Optional[int] = 1,
+        mp_context: Optional[BaseContext] = None) -> List[Document]:
+    """
+    Load and chunk the PDFs of one category folder.
+
+    Args:
+        folder (str): Folder containing the category's PDF files.
+        category (str): Category assigned to the loaded documents.
+        max_workers (Optional[int], optional): Processes used to parse the folder's PDFs.
+            Defaults to 1 (serial), as this normally runs inside a category worker process.
+        mp_context (Optional[BaseContext], optional): Multiprocessing context for the PDF
+            worker pool. Defaults to None (platform default).
+
+    Returns:
+        List[Document]: Chunks of all PDFs in the folder.
+    """
+    return chunk_documents(load_pdfs(folder, category, max_workers=max_workers, mp_context=mp_context))
 
 def process_pdfs(
         data_root: str = "./data", 
-        output_prefix: str = "chunks"):
+        output_prefix: str = "chunks",
+        binary_recall: bool = False,
+        mp_context: Optional[BaseContext] = None) -> bool:
     """
      Load PDFs from categorized folders, split them into chunks, 
     and store FAISS and BM25 indexes along with pickled chunks.
@@ -16,26 +46,47 @@ def process_pdfs(
             Defaults to "./data". If empty or no valid PDFs found, uses pre-included EFDA PDFs.
         output_prefix (str, optional): Prefix used for output files and FAISS/BM25 directories.
             Defaults to "chunks".
+        binary_recall (bool, optional): Also store a binary FAISS index for first-stage
+            dense recall. Defaults to False.
+        mp_context (Optional[BaseContext], optional): Multiprocessing context for the PDF
+            worker pools. Defaults to None (platform default, i.e. fork on Linux).
 
     Returns:
-        None
+        bool: True if chunks and indexes were written, False if no PDFs were
+            processed or saving/indexing failed.
     """
     all_docs = []
 
     # Check for user-provided PDFs in data_root or fall back to pre-included EFDA PDFs
     pdf_files = []
     if os.path.exists(data_root) and os.listdir(data_root):
-        # Iterate through all categories (subfolders) in the data root
-        for cat in os.listdir(data_root):
-            folder = os.path.join(data_root, cat)
-            if os.path.isdir(folder):
-                try:
-                    # Load PDFs from this category and chunk them
-                    pdf_docs = load_pdfs(folder, cat)
-                    all_docs.extend(chunk_documents(pdf_docs))
-                except Exception as e:
-                    # Log errors per category without stopping the process
-                    print(f"Error processing category {cat}: {e}")
+        # Category subfolders, plus PDFs placed directly in the root (e.g. app uploads)
+        # which have no category folder
+        jobs = [
+            (os.path.join(data_root, cat), cat) for cat in os.listdir(data_root)
+            if os.path.isdir(os.path.join(data_root, cat))
+        ]
+        if any(f.lower().endswith(".pdf") for f in os.listdir(data_root)):
+            jobs.append((data_root, "uncategorized"))
+
+        if len(jobs) == 1:
+            # A single category (e.g. only uploads): parallelize across its PDFs instead
+            folder, cat = jobs[0]
+            try:
+                all_docs.extend(_load_and_chunk(folder, cat, max_workers=None, mp_context=mp_context))
+            except Exception as e:
+                print(f"Error processing category {cat}: {e}")
+        elif jobs:
+            # Load and chunk categories in parallel processes; PDF parsing is CPU-bound
+            with ProcessPoolExecutor(mp_context=mp_context) as ex:
+                futures = [(cat, ex.submit(_load_and_chunk, folder, cat)) for folder, cat in jobs]
+                # Collect in submission order so chunk order (and index ids) stay deterministic
+                for cat, future in futures:
+                    try:
+                        all_docs.extend(future.result())
+                    except Exception as e:
+                        # Log errors per category without stopping the process
+                        print(f"Error processing category {cat}: {e}")
     else:
         # Fallback to pre-included EFDA PDFs if no valid data_root content
         default_pdfs = {
@@ -45,34 +96,84 @@ def process_pdfs(
             for pdf_path in pdf_list:
                 if os.path.exists(pdf_path):
                     try:
-                        pdf_docs = load_pdfs(pdf_path, cat)  # Adjust load_pdfs to handle single file if needed
+                        pdf_docs = load_pdfs(pdf_path, cat, mp_context=mp_context)  # Adjust load_pdfs to handle single file if needed
                         all_docs.extend(chunk_documents(pdf_docs))
                     except Exception as e:
                         print(f"Error processing default PDF {pdf_path}: {e}")
 
     if not all_docs:
         print("No PDFs processed. Using pre-existing data if available.")
-        return
+        return False
 
     try:
         # Define output file paths
         output_file = f"{output_prefix}.pkl"
+        db_file = f"{output_prefix}.sqlite"
         faiss_dir = f"{output_prefix}_faiss_store"
-        bm25_file = f"{output_prefix}_bm25.pkl"
+        bm25_dir = f"{output_prefix}_bm25"
 
         # Save all_docs as a pickle file
         with open(output_file, "wb") as f:
-            pickle.dump(all_docs, f)
+            pickle.dump(all_docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Save chunk metadata/text into SQLite for indexed, random-access reads
+        store_chunk_db(all_docs, db_file=db_file)
         
         # Store FAISS index
-        store_chunks(all_docs, faiss_dir=faiss_dir)
+        store_chunks(all_docs, faiss_dir=faiss_dir, binary_recall=binary_recall)
 
-        # Store BM25 retriever
-        get_bm25_retriever(all_docs, bm25_file=bm25_file)
+        # Store BM25 index
+        get_bm25_retriever(all_docs, bm25_dir=bm25_dir)
 
     except Exception as e:
         # Handle any saving/indexing errors
         print(f"Error saving chunks/indexes: {e}")
+        return False
+
+    try:
+        # Pre-tokenize chunk texts for the reranker, stored alongside the FAISS index.
+        # Optional cache: the reranker tokenizes on the fly when it is missing
+        store_rerank_tokens(all_docs, faiss_dir, RERANKER_MODEL)
+    except Exception as e:
+        print(f"Error storing reranker tokens (reranking will tokenize at query time): {e}")
+    return True
+
+def run_pipeline(
+        input_dir: str = "./data",
+        output_prefix: str = "chunks",
+        binary_recall: bool = False) -> bool:
+    """
+    Run the PDF processing pipeline in the current process.
+
+    Lets callers such as the Streamlit app reuse already-imported libraries and
+    models instead of spawning a new interpreter. PDF worker pools use the "spawn"
+    start method: forking a multi-threaded server (torch/OpenMP pools, the query
+    embedder thread) risks deadlocks in the children.
+
+    Args:
+        input_dir (str, optional): Root folder with category subfolders and/or PDFs.
+            Defaults to "./data".
+        output_prefix (str, optional): Prefix used for output files and FAISS/BM25 directories.
+            Defaults to "chunks".
+        binary_recall (bool, optional): Also store a binary FAISS index for first-stage
+            dense recall. Defaults to False.
+
+    Returns:
+        bool: True if chunks and indexes were written, False otherwise.
+    """
+    return process_pdfs(
+        data_root=input_dir,
+        output_prefix=output_prefix,
+        binary_recall=binary_recall,
+        mp_context=multiprocessing.get_context("spawn")
+    )
 
 if __name__ == "__main__":
-    process_pdfs()
+    parser = argparse.ArgumentParser(description="Chunk EFDA PDFs and build FAISS/BM25 indexes.")
+    parser.add_argument("--input_dir", "--data_root", dest="input_dir", default="./data", help="Root folder of category subfolders with PDFs")
+    parser.add_argument("--output_prefix", default="chunks", help="Prefix for output files and index directories")
+    parser.add_argument("--binary_recall", action="store_true", help="Also store a binary FAISS index for first-stage recall")
+    args = parser.parse_args()
+    # A fresh single-threaded interpreter, so the platform's default (fork) pools are safe
+    if not process_pdfs(data_root=args.input_dir, output_prefix=args.output_prefix, binary_recall=args.binary_recall):
+        raise SystemExit(1)